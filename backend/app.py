@@ -3,17 +3,68 @@ FastAPI application for Nova Demo
 Multimodal AI chat with MCP (Model Context Protocol) support
 """
 
+import logging
+import os
+from contextlib import asynccontextmanager
+
+import httpx
+import orjson
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 # Import routers
 from routers import chat, mcp
+from services.mcp_service import ENABLE_MCP, mcp_manager
+from services.model_catalog import model_catalog
+from services.streaming import upstream_stats
+
+# Application loggers (services, MCP client); uvicorn configures its own
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(levelname)s:     %(name)s - %(message)s"
+)
+# httpx logs every upstream request at INFO; only show that when debugging
+if logging.getLogger().getEffectiveLevel() > logging.DEBUG:
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared resources on startup and release them on shutdown"""
+    # One pooled client for all OpenRouter traffic, bound to the server's loop.
+    # Streams may run for minutes, so only connecting is bounded.
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(None, connect=10.0),
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200)
+    )
+    
+    # Load the model catalog up front so the first chat request skips the fetch
+    try:
+        await model_catalog.refresh(app.state.http)
+    except (httpx.HTTPError, KeyError, orjson.JSONDecodeError) as e:
+        logger.warning("Model catalog warm-up failed, will load on first request: %s", e)
+    
+    if ENABLE_MCP:
+        mcp_manager.start_health_checks()
+    
+    yield
+    
+    if ENABLE_MCP:
+        await mcp_manager.stop_health_checks()
+        await mcp_manager.cleanup_all()
+    await app.state.http.aclose()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="Nova Demo API",
     description="Multimodal AI chat with MCP support",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Enable CORS for all origins
@@ -27,7 +78,8 @@ app.add_middleware(
 
 # Include routers
 app.include_router(chat.router)
-app.include_router(mcp.router)
+if ENABLE_MCP:
+    app.include_router(mcp.router)
 
 
 @app.get("/")
@@ -38,3 +90,9 @@ async def root():
         "status": "running",
         "version": "1.0.0"
     }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Upstream streaming admission-control counters"""
+    return {"upstream_streams": upstream_stats()}
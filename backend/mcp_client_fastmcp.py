@@ -1,19 +1,31 @@
 import asyncio
 import json
+import logging
 import os
-from typing import Optional, Dict, List, Any
+import time
+from collections import defaultdict
+from typing import Optional, Dict, List, Any, Tuple
+
+logger = logging.getLogger(__name__)
 
 try:
     from fastmcp import Client
 except ImportError:
-    print("FastMCP not installed. Please install with: pip install fastmcp")
+    logger.warning("FastMCP not installed. Please install with: pip install fastmcp")
     Client = None
 
+# Seconds a cached client may sit unused before it is pinged on reuse
+HEALTH_CHECK_INTERVAL = 30.0
+
+# Seconds a single tool call may run before it is abandoned
+TOOL_CALL_TIMEOUT = 30.0
+
 class MCPClient:
     def __init__(self):
         self.client: Optional[Client] = None
         self.available_tools = []
         self.connected = False
+        self.last_ok = 0.0
 
     def convert_tool_format(self, tool):
         """Convert MCP tool definition to OpenAI-compatible tool definition"""
@@ -35,11 +47,11 @@ class MCPClient:
     async def connect_to_server(self, server_config: Dict[str, Any]):
         """Connect to an MCP server with the given configuration"""
         if Client is None:
-            print("FastMCP not available")
+            logger.warning("FastMCP not available")
             return False
             
         try:
-            print(f"Attempting to connect to MCP server with config: {server_config}")
+            logger.debug("Attempting to connect to MCP server with config: %s", server_config)
             
             # Create FastMCP client based on config
             if server_config.get("command") and server_config.get("args"):
@@ -68,7 +80,7 @@ class MCPClient:
                     }
                 })
             else:
-                print("Invalid server config - no command or URL provided")
+                logger.warning("Invalid server config - no command or URL provided")
                 return False
 
             # Test connection with timeout
@@ -79,19 +91,20 @@ class MCPClient:
                     
                     # List available tools
                     tools = await self.client.list_tools()
-                    print(f"Retrieved {tools} tools from MCP server")
+                    logger.debug("Retrieved %s tools from MCP server", tools)
                     self.available_tools = [self.convert_tool_format(tool) for tool in tools]
                     self.connected = True
+                    self.last_ok = time.monotonic()
                     
-                    print(f"Connected to MCP server with tools: {[tool['function']['name'] for tool in self.available_tools]}")
+                    logger.info("Connected to MCP server with tools: %s", [tool['function']['name'] for tool in self.available_tools])
                     return True
                     
         except asyncio.TimeoutError:
-            print("Timeout connecting to MCP server")
+            logger.warning("Timeout connecting to MCP server")
             self.connected = False
             return False
         except Exception as e:
-            print(f"Failed to connect to MCP server: {e}")
+            logger.warning("Failed to connect to MCP server: %s", e)
             self.connected = False
             return False
 
@@ -103,9 +116,9 @@ class MCPClient:
 
     async def call_tool(self, tool_name: str, tool_args: Dict[str, Any]) -> Dict[str, Any]:
         """Execute a tool call through the MCP server"""
-        print(f"Calling tool {tool_name} with args {tool_args}")
+        logger.debug("Calling tool %s with args %s", tool_name, tool_args)
         if not self.connected or not self.client:
-            print("MCP client not connected")
+            logger.warning("MCP client not connected")
             return {
                 "success": False,
                 "error": "MCP client not connected",
@@ -115,10 +128,11 @@ class MCPClient:
         
         try:
             # Use the client in context
-            async with asyncio.timeout(30.0):  # 30 second timeout
+            async with asyncio.timeout(TOOL_CALL_TIMEOUT):
                 async with self.client:
                     result = await self.client.call_tool(tool_name, tool_args)
-                    print(f"Tool {tool_name} executed successfully")
+                    logger.debug("Tool %s executed successfully", tool_name)
+                    self.last_ok = time.monotonic()
                     
                     # Extract content from FastMCP result
                     content = []
@@ -139,8 +153,8 @@ class MCPClient:
                     }
                     
         except asyncio.TimeoutError:
-            error_msg = f"Tool {tool_name} timed out after 30 seconds"
-            print(error_msg)
+            error_msg = f"Tool {tool_name} timed out after {TOOL_CALL_TIMEOUT:g} seconds"
+            logger.warning(error_msg)
             return {
                 "success": False,
                 "error": error_msg,
@@ -149,7 +163,7 @@ class MCPClient:
             }
         except Exception as e:
             error_msg = f"Error executing tool {tool_name}: {e}"
-            print(error_msg)
+            logger.warning(error_msg)
             return {
                 "success": False,
                 "error": str(e),
@@ -157,6 +171,35 @@ class MCPClient:
                 "tool_args": tool_args
             }
 
+    def is_fresh(self) -> bool:
+        """True if the connection was proven recently enough to skip a ping"""
+        return (
+            self.connected
+            and self.client is not None
+            and time.monotonic() - self.last_ok < HEALTH_CHECK_INTERVAL
+        )
+
+    async def health_check(self) -> bool:
+        """Ping the server to confirm a cached client is still usable"""
+        if not self.connected or not self.client:
+            return False
+        
+        # Skip the round-trip if the connection was proven recently
+        if self.is_fresh():
+            return True
+        
+        try:
+            async with asyncio.timeout(5.0):
+                async with self.client:
+                    await self.client.ping()
+            self.last_ok = time.monotonic()
+            return True
+        except Exception as e:
+            # Leave `connected` alone: in-flight requests may still hold this
+            # client, and the manager replaces it under its lock
+            logger.info("MCP health check failed: %s", e)
+            return False
+
     async def cleanup(self):
         """Clean up the MCP client connection"""
         # FastMCP clients clean up automatically when exiting context
@@ -168,25 +211,84 @@ class MCPManager:
     def __init__(self):
         self.clients: Dict[str, MCPClient] = {}
         self.default_configs = json.load(open(os.path.join(os.path.dirname(__file__), 'mcp_servers.json')))
+        # One lock per client key: concurrent cold starts for a server share one
+        # handshake without holding up requests for other servers
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._configs: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._health_task: Optional[asyncio.Task] = None
 
     async def get_or_create_client(self, server_type: str = "filesystem", custom_config: Optional[Dict] = None) -> MCPClient:
-        """Get existing client or create new one"""
-        client_key = f"{server_type}_{hash(str(custom_config) if custom_config else '')}"
+        """Get existing client or create new one, reconnecting only if the cached one is unhealthy"""
+        client_key = f"{server_type}_{hash(json.dumps(custom_config, sort_keys=True)) if custom_config else ''}"
         
-        if client_key not in self.clients:
-            client = MCPClient()
-            config = custom_config or self.default_configs.get(server_type)
+        # Fast path: a recently proven client needs no lock and no ping
+        client = self.clients.get(client_key)
+        if client is not None and client.is_fresh():
+            return client
+        
+        async with self._locks[client_key]:
+            # Only the lock holder pings a stale client; another request may
+            # also have checked or reconnected it while we waited
+            client = self.clients.get(client_key)
+            if client is not None and await client.health_check():
+                return client
             
+            config = custom_config or self.default_configs.get(server_type)
             if not config:
                 raise ValueError(f"No configuration found for server type: {server_type}")
             
-            success = await client.connect_to_server(config)
-            if success:
-                self.clients[client_key] = client
-            else:
-                raise Exception(f"Failed to connect to {server_type} MCP server")
+            return await self._connect(client_key, server_type, config)
+
+    async def _connect(self, client_key: str, server_type: str, config: Dict[str, Any]) -> MCPClient:
+        """Open a new client for client_key and cache it; callers hold its lock"""
+        client = MCPClient()
+        success = await client.connect_to_server(config)
+        if not success:
+            raise Exception(f"Failed to connect to {server_type} MCP server")
         
-        return self.clients[client_key]
+        self.clients[client_key] = client
+        self._configs[client_key] = (server_type, config)
+        return client
+
+    async def _check_clients(self):
+        """Ping every cached client and reconnect the ones that stopped answering"""
+        for client_key, client in list(self.clients.items()):
+            async with self._locks[client_key]:
+                if self.clients.get(client_key) is not client:
+                    continue  # already replaced by a request
+                if await client.health_check():
+                    continue
+                try:
+                    await self._connect(client_key, *self._configs[client_key])
+                    logger.info("Reconnected MCP client %s", client_key)
+                except Exception as e:
+                    # Drop it; the next request will try again
+                    logger.warning("MCP client %s is down: %s", client_key, e)
+                    self.clients.pop(client_key, None)
+                    await client.cleanup()
+
+    async def _health_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._check_clients()
+            except Exception:
+                logger.exception("MCP health check pass failed")
+
+    def start_health_checks(self, interval: float = HEALTH_CHECK_INTERVAL):
+        """Start the background task that keeps cached clients connected"""
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(interval))
+
+    async def stop_health_checks(self):
+        """Cancel the background health-check task"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
 
     async def cleanup_all(self):
         """Clean up all MCP client connections"""
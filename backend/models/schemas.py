@@ -2,8 +2,8 @@
 Pydantic models for request/response validation
 """
 
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, List, Dict
 
 
 class ImageData(BaseModel):
@@ -26,26 +26,33 @@ class PdfData(BaseModel):
 
 class Message(BaseModel):
     """Chat message with optional multimodal attachments"""
+    # Strict: no type coercion on the hot path; intern repeated keys like "data"/"format"
+    model_config = ConfigDict(extra='ignore', strict=True, cache_strings='keys')
+
     role: str
     content: str
-    image: Optional[dict] = None
-    audio: Optional[dict] = None
-    pdf: Optional[dict] = None
+    # Attachments stay plain str->str dicts (base64 data, format, filename, url)
+    # so validation is a single pass in pydantic-core with no submodel objects
+    image: Optional[Dict[str, str]] = None
+    audio: Optional[Dict[str, str]] = None
+    pdf: Optional[Dict[str, str]] = None
 
 
 class ChatRequest(BaseModel):
     """Request model for chat endpoint"""
     model_id: str
-    chat_history: List[Message]
+    chat_history: List[Message] = Field(..., min_length=1)
     use_mcp: bool = False
     mcp_server_type: str = "cmu_api"
     mcp_auto_approve: bool = False
+    # Sampling temperature; 0 makes the response deterministic and cacheable
+    temperature: Optional[float] = None
 
 
 class ToolCallApprovalRequest(BaseModel):
     """Request model for tool call approval"""
     tool_calls: List[dict]
     approved: bool
-    chat_history: List[Message]
+    chat_history: List[Message] = Field(..., min_length=1)
     model_id: str
     mcp_server_type: str = "cmu_api"
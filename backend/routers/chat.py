@@ -2,22 +2,34 @@
 Chat-related API routes
 """
 
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
-import requests
+from typing import Tuple
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response, StreamingResponse
+import httpx
 
 from models.schemas import ChatRequest, ToolCallApprovalRequest
-from services.chat_service import ChatService
-from services.mcp_service import mcp_manager
-from utils import OPENROUTER_API_KEY
-import json
-import asyncio
+from services.chat_service import ChatService, execute_tool_calls, scan_attachments
+from services.http_client import get_http_client
+from services.mcp_service import ENABLE_MCP, mcp_manager
+from services.model_catalog import get_model
+from services.request_coalescer import RequestCoalescer
+from services.streaming import SSE_DONE, STREAM_HEADERS, aiter_sse_data, upstream_slot
+from utils import OPENROUTER_HEADERS, OPENROUTER_URL
+import orjson
 
 router = APIRouter()
 
+# Concurrent identical /chat requests share a single upstream completion
+chat_coalescer = RequestCoalescer()
+
 
 @router.post("/chat")
-async def chat(model_id: str, prompt: str):
+async def chat(
+    model_id: str,
+    prompt: str,
+    http_client: httpx.AsyncClient = Depends(get_http_client)
+):
     """
     Simple chat endpoint (non-streaming)
     
@@ -29,29 +41,30 @@ async def chat(model_id: str, prompt: str):
         Model response
     """
     # Get model data from OpenRouter
-    all_models = requests.get('https://openrouter.ai/api/v1/models').json()['data']
-    model_data = next((m for m in all_models if m['id'] == model_id), None)
+    model_data = await get_model(model_id, http_client)
+    if model_data is None:
+        raise HTTPException(status_code=404, detail="Model not found")
     
-    if not model_data:
-        return {"error": "Model not found"}
+    chat_service = ChatService(model_id, model_data, http_client)
+    messages = [{'role': 'user', 'content': prompt}]
     
-    chat_service = ChatService(model_id, model_data)
-    messages = [{'role': 'user', 'content': [{'type': 'text', 'text': prompt}]}]
+    payload = await chat_service.create_payload(messages)
     
-    payload = chat_service.create_payload(messages)
+    async def complete() -> Tuple[int, bytes]:
+        response = await http_client.post(OPENROUTER_URL, headers=OPENROUTER_HEADERS, content=orjson.dumps(payload))
+        return response.status_code, response.content
     
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    
-    response = requests.post(url=url, headers=headers, json=payload)
-    return response.json()
+    status_code, content = await chat_coalescer.run(RequestCoalescer.key(payload), complete)
+    # Relay the upstream status and JSON body as-is rather than decoding and re-encoding it,
+    # so an upstream error reaches every coalesced caller as an error
+    return Response(content=content, status_code=status_code, media_type="application/json")
 
 
 @router.post("/chat_streaming")
-async def chat_streaming(request: ChatRequest):
+async def chat_streaming(
+    request: ChatRequest,
+    http_client: httpx.AsyncClient = Depends(get_http_client)
+):
     """
     Chat endpoint with streaming support and optional MCP tools
     
@@ -62,38 +75,55 @@ async def chat_streaming(request: ChatRequest):
         Streaming response
     """
     # Get model data
-    all_models = requests.get('https://openrouter.ai/api/v1/models').json()['data']
-    model_data = next((m for m in all_models if m['id'] == request.model_id), None)
+    model_data = await get_model(request.model_id, http_client)
+    if model_data is None:
+        raise HTTPException(status_code=404, detail="Model not found")
     
-    if not model_data:
-        return {"error": "Model not found"}
+    chat_service = ChatService(request.model_id, model_data, http_client)
     
-    chat_service = ChatService(request.model_id, model_data)
     messages = chat_service.prepare_messages(request.chat_history)
     
-    # Check if any messages have PDFs
-    has_pdf = any(msg.pdf for msg in request.chat_history)
+    # Reject attachments the model cannot read before building the payload;
+    # only those that survived trimming are actually sent
+    has_image, has_audio, has_pdf = scan_attachments(messages)
+    try:
+        chat_service.check_input_modalities(has_image, has_audio)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    payload = chat_service.create_payload(
+    use_mcp = request.use_mcp and ENABLE_MCP
+    
+    payload = await chat_service.create_payload(
         messages,
-        use_mcp=request.use_mcp,
+        use_mcp=use_mcp,
         mcp_server_type=request.mcp_server_type,
-        has_pdf=has_pdf
+        has_pdf=has_pdf,
+        temperature=request.temperature
     )
     
-    def event_generator():
-        yield from chat_service.stream_response(
-            payload,
-            use_mcp=request.use_mcp,
-            mcp_auto_approve=request.mcp_auto_approve,
-            mcp_server_type=request.mcp_server_type
-        )
-    
-    return StreamingResponse(event_generator(), media_type="application/stream+json")
+    async def event_generator():
+        # Wait for a free upstream slot instead of piling onto the provider
+        async with upstream_slot():
+            async for chunk in chat_service.stream_response(
+                payload,
+                use_mcp=use_mcp,
+                mcp_auto_approve=request.mcp_auto_approve,
+                mcp_server_type=request.mcp_server_type
+            ):
+                yield chunk
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="application/stream+json",
+        headers=STREAM_HEADERS
+    )
 
 
 @router.post("/mcp/approve_tool_calls_streaming")
-async def approve_tool_calls_streaming(request: ToolCallApprovalRequest):
+async def approve_tool_calls_streaming(
+    request: ToolCallApprovalRequest,
+    http_client: httpx.AsyncClient = Depends(get_http_client)
+):
     """
     Execute approved tool calls and return streaming response
     
@@ -103,10 +133,13 @@ async def approve_tool_calls_streaming(request: ToolCallApprovalRequest):
     Returns:
         Streaming response with tool execution results
     """
+    if not ENABLE_MCP:
+        raise HTTPException(status_code=503, detail="MCP is disabled")
+    
     try:
         if not request.approved:
-            def decline_generator():
-                yield json.dumps({
+            async def decline_generator():
+                yield orjson.dumps({
                     "choices": [{
                         "delta": {
                             "content": "Tool calls were declined by the user."
@@ -115,52 +148,21 @@ async def approve_tool_calls_streaming(request: ToolCallApprovalRequest):
                 })
                 yield "data: [DONE]\n\n"
             
-            return StreamingResponse(decline_generator(), media_type="application/stream+json")
+            return StreamingResponse(decline_generator(), media_type="text/event-stream", headers=STREAM_HEADERS)
         
-        def event_generator():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
+        model_data = await get_model(request.model_id, http_client)
+        if model_data is None:
+            raise HTTPException(status_code=404, detail="Model not found")
+        
+        chat_service = ChatService(request.model_id, model_data, http_client)
+        
+        async def event_generator():
             try:
-                client = loop.run_until_complete(
-                    mcp_manager.get_or_create_client(request.mcp_server_type)
-                )
+                client = await mcp_manager.get_or_create_client(request.mcp_server_type)
                 
                 # Build messages array
-                messages = []
-                for msg in request.chat_history:
-                    content = []
-                    
-                    if msg.content:
-                        content.append({'type': 'text', 'text': msg.content})
-                    
-                    if msg.image:
-                        img_data = msg.image
-                        url = f"data:image/{img_data['format']};base64,{img_data['data']}"
-                        content.append({'type': 'image_url', 'image_url': {'url': url}})
-                    
-                    if msg.audio:
-                        audio_data = msg.audio
-                        content.append({
-                            'type': 'input_audio',
-                            'input_audio': {
-                                'data': audio_data['data'],
-                                'format': audio_data['format']
-                            }
-                        })
-                    
-                    if msg.pdf:
-                        pdf_data = msg.pdf
-                        pdf_url = f"data:application/pdf;base64,{pdf_data['data']}"
-                        content.append({
-                            'type': 'file',
-                            'file': {
-                                'filename': pdf_data['filename'],
-                                'file_data': pdf_url
-                            }
-                        })
-                    
-                    messages.append({'role': msg.role, 'content': content})
+                messages = chat_service.prepare_messages(request.chat_history)
+                _, _, has_pdf = scan_attachments(messages)
                 
                 # Add assistant message with tool calls
                 messages.append({
@@ -170,60 +172,31 @@ async def approve_tool_calls_streaming(request: ToolCallApprovalRequest):
                 })
                 
                 # Execute tool calls
-                for tool_call in request.tool_calls:
-                    tool_name = tool_call['function']['name']
-                    tool_args = json.loads(tool_call['function']['arguments'])
-                    tool_result = loop.run_until_complete(client.call_tool(tool_name, tool_args))
-                    
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call['id'],
-                        "name": tool_name,
-                        "content": json.dumps(tool_result) if tool_result['success'] else f"Error: {tool_result['error']}"
-                    })
-                
-                # Make final streaming request
-                url = "https://openrouter.ai/api/v1/chat/completions"
-                headers = {
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                }
+                messages.extend(await execute_tool_calls(client, request.tool_calls))
                 
-                payload = {
-                    'model': request.model_id,
-                    'messages': messages,
-                    'stream': True
-                }
+                # Make final streaming request; same payload shape (modalities,
+                # PDF plugin) as the turn that proposed the tool calls, minus tools
+                payload = await chat_service.create_payload(messages, has_pdf=has_pdf)
+                payload['stream'] = True
                 
-                buffer = ''
-                with requests.post(url, headers=headers, json=payload, stream=True) as response:
-                    for chunk in response.iter_content(chunk_size=1024, decode_unicode=False):
-                        chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
-                        buffer += chunk
-                        while True:
-                            try:
-                                line_end = buffer.find("\n")
-                                if line_end == -1:
-                                    break
-                                line = buffer[:line_end].strip()
-                                buffer = buffer[line_end + 1:]
-                                if line.startswith("data: "):
-                                    data = line[6:]
-                                    if data == "[DONE]":
-                                        yield "data: [DONE]\n\n"
-                                        return
-                                    yield f"data: {data}\n\n"
-                            except Exception:
-                                break
+                async with http_client.stream("POST", OPENROUTER_URL, headers=OPENROUTER_HEADERS, content=orjson.dumps(payload)) as response:
+                    async for data in aiter_sse_data(response):
+                        if data == SSE_DONE:
+                            yield "data: [DONE]\n\n"
+                            return
+                        yield b"data: " + data + b"\n\n"
                 
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
-            finally:
-                loop.close()
+                yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
         
-        return StreamingResponse(event_generator(), media_type="application/stream+json")
+        return StreamingResponse(event_generator(), media_type="text/event-stream", headers=STREAM_HEADERS)
         
+    except HTTPException:
+        raise
     except Exception as e:
-        def error_generator():
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
-        return StreamingResponse(error_generator(), media_type="application/stream+json")
+        # Render now: `e` is unbound once the except block exits
+        error_frame = b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
+        
+        async def error_generator():
+            yield error_frame
+        return StreamingResponse(error_generator(), media_type="text/event-stream", headers=STREAM_HEADERS)
@@ -2,72 +2,198 @@
 Chat service for handling AI model interactions
 """
 
-import requests
-import json
+import os
 import asyncio
-from typing import Generator, Dict, Any, List
+import logging
+import httpx
+import orjson
+from typing import AsyncGenerator, Dict, Any, List, Optional, Tuple, Union
 from models.schemas import Message
-from services.mcp_service import mcp_manager
-from utils import OPENROUTER_API_KEY
+from services.content_builder import build_content_blocks
+from services.mcp_service import MCPClient, mcp_manager
+from services.response_cache import is_cacheable, response_cache
+from services.streaming import SSE_DONE, aiter_sse_data
+from utils import OPENROUTER_HEADERS, OPENROUTER_URL
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bound on MCP tool calls in flight at once, across all requests
+MCP_TOOL_CONCURRENCY = int(os.getenv("MCP_TOOL_CONCURRENCY", "8"))
+_tool_call_slots = asyncio.Semaphore(MCP_TOOL_CONCURRENCY)
+
+# Tool output beyond this many characters is cut before it is sent back to the model
+MAX_TOOL_RESULT_CHARS = int(os.getenv("MAX_TOOL_RESULT_CHARS", "32768"))
+
+# Attachments older than this many user turns are elided from history (0 keeps them all)
+MAX_MEDIA_AGE = int(os.getenv("MAX_MEDIA_AGE", "0"))
+
+# Placeholder text for a collapsed attachment (formatted with the block's fields),
+# and where each block type keeps its payload
+MEDIA_PLACEHOLDERS = {
+    'image_url': ("[image omitted]", 'image_url', 'url'),
+    'input_audio': ("[audio omitted]", 'input_audio', 'data'),
+    'file': ("[PDF omitted: {filename}]", 'file', 'file_data'),
+}
+
+
+def build_openai_messages(history: List[Message]) -> List[Dict[str, Any]]:
+    """Convert chat history to OpenRouter (OpenAI-compatible) message format"""
+    # Built in one comprehension, so the list is sized once rather than grown per append.
+    # Text-only turns (the common case) use the plain string form.
+    return [
+        {
+            'role': msg.role,
+            'content': msg.content
+            if msg.image is None and msg.audio is None and msg.pdf is None
+            else build_content_blocks(msg)
+        }
+        for msg in history
+    ]
+
+
+def scan_attachments(messages: List[Dict[str, Any]]) -> Tuple[bool, bool, bool]:
+    """
+    Report whether an OpenRouter message list carries an image, audio, or PDF block
+    
+    Scan the list after trim_history so attachments already collapsed to a
+    placeholder are not counted.
+    """
+    block_types = {
+        block['type']
+        for msg in messages
+        if isinstance(msg['content'], list)
+        for block in msg['content']
+    }
+    return 'image_url' in block_types, 'input_audio' in block_types, 'file' in block_types
+
+
+def trim_history(
+    messages: List[Dict[str, Any]],
+    max_media_age: int = MAX_MEDIA_AGE
+) -> List[Dict[str, Any]]:
+    """
+    Prune an OpenRouter message list in place before it is sent upstream
+    
+    Walks newest to oldest, counting user turns. An attachment repeating a
+    newer identical upload is collapsed to a short text block, so the most
+    recent copy of each is always kept. If max_media_age is set, attachments
+    older than that many user turns are collapsed as well. Text content is
+    never dropped.
+    """
+    seen_media = set()
+    user_turns = 0
+    elided = 0
+    
+    for msg in reversed(messages):
+        content = msg['content']
+        
+        if isinstance(content, list):
+            for i, block in enumerate(content):
+                media = MEDIA_PLACEHOLDERS.get(block['type'])
+                if media is None:
+                    continue
+                
+                placeholder, field, payload_key = media
+                # The base64 string itself is the dedup key; set lookup hashes it once
+                payload = block[field][payload_key]
+                if payload in seen_media or (max_media_age and user_turns > max_media_age):
+                    content[i] = {'type': 'text', 'text': placeholder.format(**block[field])}
+                    elided += 1
+                else:
+                    seen_media.add(payload)
+        
+        if msg['role'] == 'user':
+            user_turns += 1
+    
+    if elided:
+        logger.info("Elided %d attachment(s) from chat history", elided)
+    
+    return messages
+
+
+def tool_result_content(tool_result: Dict[str, Any]) -> str:
+    """Render an MCP tool result as the content string of a tool-role message"""
+    if not tool_result['success']:
+        return f"Error: {tool_result['error']}"
+    
+    content = tool_result['content']
+    # A single text block goes through as-is; anything else is encoded once
+    text = content[0] if len(content) == 1 else orjson.dumps(content).decode()
+    
+    if len(text) > MAX_TOOL_RESULT_CHARS:
+        text = text[:MAX_TOOL_RESULT_CHARS] + "\n[truncated]"
+    return text
+
+
+async def execute_tool_calls(client: MCPClient, tool_calls: List[Dict]) -> List[Dict[str, Any]]:
+    """
+    Run tool calls concurrently and return the matching tool-role messages in order
+    
+    A call that fails, including on malformed arguments, becomes an error
+    message for that call only; the others still run to completion.
+    """
+    async def call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
+        function = tool_call['function']
+        tool_args = orjson.loads(function['arguments'] or "{}")
+        async with _tool_call_slots:
+            return await client.call_tool(function['name'], tool_args)
+    
+    results = await asyncio.gather(*map(call, tool_calls), return_exceptions=True)
+    
+    messages = []
+    for tool_call, tool_result in zip(tool_calls, results):
+        tool_name = tool_call['function']['name']
+        if isinstance(tool_result, BaseException):
+            logger.warning("Tool %s failed: %s", tool_name, tool_result)
+            content = f"Error: {tool_result}"
+        else:
+            content = tool_result_content(tool_result)
+        
+        messages.append({
+            "role": "tool",
+            "tool_call_id": tool_call['id'],
+            "name": tool_name,
+            "content": content
+        })
+    
+    return messages
 
 
 class ChatService:
     """Service for managing chat interactions with AI models"""
     
-    def __init__(self, model_id: str, model_data: Dict[str, Any]):
+    def __init__(self, model_id: str, model_data: Dict[str, Any], http_client: httpx.AsyncClient):
         self.model_id = model_id
         self.model_data = model_data
+        self.http_client = http_client
     
-    def prepare_messages(self, chat_history: List[Message]) -> List[Dict[str, Any]]:
-        """Convert chat history to OpenRouter message format"""
-        messages = []
+    def check_input_modalities(self, has_image: bool, has_audio: bool):
+        """
+        Raise ValueError if the history carries input the model cannot read
         
-        for msg in chat_history:
-            content = []
-            
-            # Add text content
-            if msg.content:
-                content.append({'type': 'text', 'text': msg.content})
-            
-            # Add image content
-            if msg.image:
-                img_data = msg.image
-                url = f"data:image/{img_data['format']};base64,{img_data['data']}"
-                content.append({'type': 'image_url', 'image_url': {'url': url}})
-            
-            # Add audio content
-            if msg.audio:
-                audio_data = msg.audio
-                content.append({
-                    'type': 'input_audio',
-                    'input_audio': {
-                        'data': audio_data['data'],
-                        'format': audio_data['format']
-                    }
-                })
-            
-            # Add PDF content
-            if msg.pdf:
-                pdf_data = msg.pdf
-                pdf_url = f"data:application/pdf;base64,{pdf_data['data']}"
-                content.append({
-                    'type': 'file',
-                    'file': {
-                        'filename': pdf_data['filename'],
-                        'file_data': pdf_url
-                    }
-                })
-            
-            messages.append({'role': msg.role, 'content': content})
+        PDFs are not checked: the file-parser plugin turns them into text for any model.
+        """
+        input_modalities = self.model_data['architecture'].get('input_modalities')
+        if input_modalities is None:
+            return
         
-        return messages
+        if has_image and 'image' not in input_modalities:
+            raise ValueError(f"Model {self.model_id} does not support image input")
+        if has_audio and 'audio' not in input_modalities:
+            raise ValueError(f"Model {self.model_id} does not support audio input")
     
-    def create_payload(
+    def prepare_messages(self, chat_history: List[Message]) -> List[Dict[str, Any]]:
+        """Convert chat history to OpenRouter message format"""
+        return trim_history(build_openai_messages(chat_history))
+    
+    async def create_payload(
         self,
         messages: List[Dict[str, Any]],
         use_mcp: bool = False,
         mcp_server_type: str = "cmu_api",
-        has_pdf: bool = False
+        has_pdf: bool = False,
+        temperature: Optional[float] = None
     ) -> Dict[str, Any]:
         """Create request payload for OpenRouter API"""
         output_modalities = self.model_data['architecture']['output_modalities']
@@ -78,22 +204,18 @@ class ChatService:
             'modalities': output_modalities
         }
         
+        if temperature is not None:
+            payload['temperature'] = temperature
+        
         # Add MCP tools if enabled
         if use_mcp:
             try:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    client = loop.run_until_complete(
-                        mcp_manager.get_or_create_client(mcp_server_type)
-                    )
-                    tools = loop.run_until_complete(client.get_available_tools())
-                    if tools:
-                        payload['tools'] = tools
-                finally:
-                    loop.close()
+                client = await mcp_manager.get_or_create_client(mcp_server_type)
+                tools = await client.get_available_tools()
+                if tools:
+                    payload['tools'] = tools
             except Exception as e:
-                print(f"Failed to load MCP tools: {e}")
+                logger.warning("Failed to load MCP tools: %s", e)
         
         # Add file parser plugin if PDFs are present
         if has_pdf:
@@ -102,80 +224,83 @@ class ChatService:
                 'pdf': {'engine': 'pdf-text'}
             }]
         
+        # Size only: the payload itself can hold megabytes of base64 attachments
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("payload size=%d bytes", len(orjson.dumps(payload)))
+        
         return payload
     
-    def stream_response(
+    async def stream_response(
         self,
         payload: Dict[str, Any],
         use_mcp: bool = False,
         mcp_auto_approve: bool = False,
         mcp_server_type: str = "cmu_api"
-    ) -> Generator[str, None, None]:
+    ) -> AsyncGenerator[Union[bytes, str], None]:
         """Stream chat response from OpenRouter API"""
-        url = "https://openrouter.ai/api/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-        }
-        
         payload['stream'] = True
-        buffer = ''
         
-        with requests.post(url, headers=headers, json=payload, stream=True) as r:
+        # Deterministic plain-chat responses are replayed from the cache
+        cache_key = None
+        if not use_mcp and is_cacheable(payload):
+            cache_key = response_cache.key(payload)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                for data in cached:
+                    yield data
+                return
+        
+        async with self.http_client.stream("POST", OPENROUTER_URL, headers=OPENROUTER_HEADERS, content=orjson.dumps(payload)) as r:
             accumulated_tool_calls = []
             accumulated_message = ""
             tool_calls_complete = False
+            streamed_chunks = []
             
-            for chunk in r.iter_content(chunk_size=1024, decode_unicode=False):
-                chunk = chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk
-                buffer += chunk
+            async for data in aiter_sse_data(r):
+                if data == SSE_DONE:
+                    tool_calls_complete = True
+                    break
+                
+                # Without tools there is nothing to inspect: forward the raw bytes
+                if not use_mcp:
+                    if cache_key is not None:
+                        streamed_chunks.append(data)
+                    yield data
+                    continue
                 
-                while True:
-                    try:
-                        line_end = buffer.find("\n")
-                        if line_end == -1:
-                            break
+                try:
+                    parsed_data = orjson.loads(data)
+                    
+                    # Handle tool calls in streaming response
+                    if 'choices' in parsed_data and len(parsed_data['choices']) > 0:
+                        choice = parsed_data['choices'][0]
                         
-                        line = buffer[:line_end].strip()
-                        buffer = buffer[line_end + 1:]
+                        if 'delta' in choice and 'content' in choice['delta']:
+                            accumulated_message += choice['delta']['content'] or ""
                         
-                        if line.startswith("data: "):
-                            data = line[6:]
-                            if data == "[DONE]":
-                                tool_calls_complete = True
-                                break
+                        if 'delta' in choice and 'tool_calls' in choice['delta']:
+                            self._accumulate_tool_calls(
+                                choice['delta']['tool_calls'],
+                                accumulated_tool_calls
+                            )
                             
-                            try:
-                                parsed_data = json.loads(data)
-                                
-                                # Handle tool calls in streaming response
-                                if use_mcp and 'choices' in parsed_data and len(parsed_data['choices']) > 0:
-                                    choice = parsed_data['choices'][0]
-                                    
-                                    if 'delta' in choice and 'content' in choice['delta']:
-                                        accumulated_message += choice['delta']['content'] or ""
-                                    
-                                    if 'delta' in choice and 'tool_calls' in choice['delta']:
-                                        self._accumulate_tool_calls(
-                                            choice['delta']['tool_calls'],
-                                            accumulated_tool_calls
-                                        )
-                                        
-                                        if not mcp_auto_approve:
-                                            continue
-                                
-                                if not use_mcp or not accumulated_tool_calls or mcp_auto_approve:
-                                    yield data
-                                    
-                            except json.JSONDecodeError:
-                                pass
-                    except Exception:
-                        break
+                            if not mcp_auto_approve:
+                                continue
+                    
+                    if not accumulated_tool_calls or mcp_auto_approve:
+                        yield data
+                        
+                except orjson.JSONDecodeError:
+                    pass
+            
+            # Only cache responses that ran to completion
+            if cache_key is not None and tool_calls_complete:
+                response_cache.set(cache_key, streamed_chunks)
             
             # Handle tool calls after streaming
             if use_mcp and accumulated_tool_calls and tool_calls_complete:
                 if not mcp_auto_approve:
-                    yield json.dumps({
+                    yield orjson.dumps({
                         "type": "tool_calls_pending",
                         "tool_calls": accumulated_tool_calls,
                         "message": "The AI wants to use tools. Do you approve?",
@@ -183,13 +308,12 @@ class ChatService:
                     })
                 else:
                     # Auto-approve: execute tools and continue
-                    yield from self._execute_tools_and_continue(
+                    async for data in self._execute_tools_and_continue(
                         accumulated_tool_calls,
                         payload,
-                        headers,
-                        url,
                         mcp_server_type
-                    )
+                    ):
+                        yield data
     
     def _accumulate_tool_calls(self, tool_calls: List[Dict], accumulated: List[Dict]):
         """Accumulate streaming tool call data"""
@@ -211,73 +335,43 @@ class ChatService:
                     if 'arguments' in tool_call['function']:
                         accumulated[index]['function']['arguments'] += tool_call['function']['arguments']
     
-    def _execute_tools_and_continue(
+    async def _execute_tools_and_continue(
         self,
         tool_calls: List[Dict],
         payload: Dict[str, Any],
-        headers: Dict[str, str],
-        url: str,
         server_name: str
-    ) -> Generator[str, None, None]:
+    ) -> AsyncGenerator[Union[bytes, str], None]:
         """Execute approved tool calls and stream final response"""
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            client = await mcp_manager.get_or_create_client(server_name)
             
-            try:
-                client = loop.run_until_complete(
-                    mcp_manager.get_or_create_client(server_name)
-                )
-                
-                messages = payload['messages'].copy()
-                messages.append({
+            tool_messages = await execute_tool_calls(client, tool_calls)
+            
+            # History, the assistant turn that requested the tools, then their results
+            messages = [
+                *payload['messages'],
+                {
                     "role": "assistant",
                     "content": "",
                     "tool_calls": tool_calls
-                })
-                
-                for tool_call in tool_calls:
-                    tool_name = tool_call['function']['name']
-                    tool_args = json.loads(tool_call['function']['arguments'] or "{}")
-                    tool_result = loop.run_until_complete(client.call_tool(tool_name, tool_args))
-                    
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call['id'],
-                        "name": tool_name,
-                        "content": json.dumps(tool_result) if tool_result['success'] else f"Error: {tool_result['error']}"
-                    })
-                
-                final_payload = payload.copy()
-                final_payload['messages'] = messages
-                if 'tools' in final_payload:
-                    del final_payload['tools']
-                
-                final_payload['stream'] = True
-                with requests.post(url, headers=headers, json=final_payload, stream=True) as final_r:
-                    final_buffer = ''
-                    for final_chunk in final_r.iter_content(chunk_size=1024, decode_unicode=False):
-                        final_chunk = final_chunk.decode('utf-8') if isinstance(final_chunk, bytes) else final_chunk
-                        final_buffer += final_chunk
-                        while True:
-                            try:
-                                line_end = final_buffer.find("\n")
-                                if line_end == -1:
-                                    break
-                                line = final_buffer[:line_end].strip()
-                                final_buffer = final_buffer[line_end + 1:]
-                                if line.startswith("data: "):
-                                    data = line[6:]
-                                    if data == "[DONE]":
-                                        break
-                                    yield data
-                            except Exception:
-                                break
-            finally:
-                loop.close()
+                },
+                *tool_messages
+            ]
+            
+            final_payload = payload.copy()
+            final_payload['messages'] = messages
+            if 'tools' in final_payload:
+                del final_payload['tools']
+            
+            final_payload['stream'] = True
+            async with self.http_client.stream("POST", OPENROUTER_URL, headers=OPENROUTER_HEADERS, content=orjson.dumps(final_payload)) as final_r:
+                async for data in aiter_sse_data(final_r):
+                    if data == SSE_DONE:
+                        break
+                    yield data
         except Exception as e:
-            print(f"Error handling auto-approved tool calls: {e}")
-            yield json.dumps({
+            logger.exception("Error handling auto-approved tool calls")
+            yield orjson.dumps({
                 "choices": [{
                     "delta": {
                         "content": f"Error executing tools: {e}"
@@ -0,0 +1,74 @@
+"""
+Content blocks for OpenRouter (OpenAI-compatible) multimodal messages
+"""
+
+from typing import Any, Dict, List
+
+from models.schemas import Message
+
+# Data URL prefixes for inline attachments
+IMAGE_URL_PREFIX = "data:image/"
+PDF_URL_PREFIX = "data:application/pdf;base64,"
+
+
+def _data_url(prefix: str, attachment: Dict[str, str]) -> str:
+    """
+    Data URL for an attachment, reusing the one the client sent when it matches
+    
+    The frontend uploads both the FileReader data URL and the base64 payload cut
+    from it, so the URL is usually exactly prefix + data and can be passed on
+    without building another copy of a possibly multi-megabyte string.
+    """
+    data = attachment['data']
+    url = attachment.get('url')
+    if (
+        url is not None
+        and len(url) == len(prefix) + len(data)
+        and url.startswith(prefix)
+        and url.endswith(data)
+    ):
+        return url
+    return prefix + data
+
+
+def _text_block(text: str) -> Dict[str, Any]:
+    return {'type': 'text', 'text': text}
+
+
+def _image_block(image: Dict[str, str]) -> Dict[str, Any]:
+    url = _data_url(f"{IMAGE_URL_PREFIX}{image['format']};base64,", image)
+    return {'type': 'image_url', 'image_url': {'url': url}}
+
+
+def _audio_block(audio: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        'type': 'input_audio',
+        'input_audio': {
+            'data': audio['data'],
+            'format': audio['format']
+        }
+    }
+
+
+def _pdf_block(pdf: Dict[str, str]) -> Dict[str, Any]:
+    return {
+        'type': 'file',
+        'file': {
+            'filename': pdf['filename'],
+            'file_data': _data_url(PDF_URL_PREFIX, pdf)
+        }
+    }
+
+
+# Message field -> block builder, in the order blocks appear in the content list
+_BUILDERS = (
+    ('content', _text_block),
+    ('image', _image_block),
+    ('audio', _audio_block),
+    ('pdf', _pdf_block),
+)
+
+
+def build_content_blocks(msg: Message) -> List[Dict[str, Any]]:
+    """Content list for one message: its text (if any) followed by its attachments"""
+    return [build(value) for field, build in _BUILDERS if (value := getattr(msg, field))]
@@ -0,0 +1,12 @@
+"""
+Shared HTTP client for outbound OpenRouter requests
+The client itself is created and closed by the app lifespan (see app.py)
+"""
+
+import httpx
+from fastapi import Request
+
+
+def get_http_client(request: Request) -> httpx.AsyncClient:
+    """FastAPI dependency returning the app-wide async HTTP client"""
+    return request.app.state.http
@@ -1,8 +1,17 @@
 """
 MCP (Model Context Protocol) service for managing MCP clients
-Re-exports the mcp_manager from mcp_client_fastmcp for cleaner imports
+Re-exports the mcp_manager and MCPClient from mcp_client_fastmcp for cleaner imports
 """
 
-from mcp_client_fastmcp import mcp_manager
+import os
 
-__all__ = ['mcp_manager']
+# Set ENABLE_MCP=0 to run plain chat only, without importing fastmcp at all
+ENABLE_MCP = os.getenv("ENABLE_MCP", "1") == "1"
+
+if ENABLE_MCP:
+    from mcp_client_fastmcp import MCPClient, mcp_manager
+else:
+    MCPClient = None
+    mcp_manager = None
+
+__all__ = ['ENABLE_MCP', 'MCPClient', 'mcp_manager']
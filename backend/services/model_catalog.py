@@ -0,0 +1,99 @@
+"""
+Cached lookup of OpenRouter model metadata
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import orjson
+
+from utils import OPENROUTER_MODELS_URL
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the cached catalog is considered stale and refetched
+MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "600"))
+
+# Seconds to wait after a failed refresh before the next attempt
+MODEL_CATALOG_RETRY = 30.0
+
+
+class ModelCatalog:
+    """In-memory copy of the OpenRouter model list, indexed by model id"""
+
+    def __init__(self, ttl: float = MODEL_CATALOG_TTL, retry: float = MODEL_CATALOG_RETRY):
+        self.ttl = ttl
+        self.retry = retry
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._fetched_at: Optional[float] = None
+        self._retry_at: Optional[float] = None
+        self._last_error: Optional[Exception] = None
+        self._lock = asyncio.Lock()
+
+    def lookup(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """Return cached metadata for model_id, or None if unknown"""
+        return self._by_id.get(model_id)
+
+    def update(self, models: List[Dict[str, Any]]):
+        """Replace the cached catalog"""
+        self._by_id = {m['id']: m for m in models}
+        self._fetched_at = time.monotonic()
+        self._retry_at = None
+        self._last_error = None
+
+    def clear(self):
+        """Drop the cached catalog so the next lookup refetches it"""
+        self._by_id = {}
+        self._fetched_at = None
+        self._retry_at = None
+        self._last_error = None
+
+    def is_stale(self) -> bool:
+        now = time.monotonic()
+        # A recent failed refresh holds off the next one until its backoff ends
+        if self._retry_at is not None and now < self._retry_at:
+            return False
+        return self._fetched_at is None or now - self._fetched_at > self.ttl
+
+    async def refresh(self, http_client: httpx.AsyncClient):
+        """Fetch the model list from OpenRouter"""
+        response = await http_client.get(OPENROUTER_MODELS_URL)
+        response.raise_for_status()
+        self.update(orjson.loads(response.content)['data'])
+        logger.info("Loaded %d models from OpenRouter", len(self._by_id))
+
+    async def get(self, model_id: str, http_client: httpx.AsyncClient) -> Optional[Dict[str, Any]]:
+        """Look up model_id, refreshing the catalog first if it has expired"""
+        if self.is_stale():
+            async with self._lock:
+                # Another request may have refreshed it while we waited for the lock
+                if self.is_stale():
+                    try:
+                        await self.refresh(http_client)
+                    except (httpx.HTTPError, KeyError, orjson.JSONDecodeError) as e:
+                        # One failed fetch per backoff window, not one per queued request
+                        self._retry_at = time.monotonic() + self.retry
+                        self._last_error = e
+                        # Keep serving the previous catalog if there is one
+                        if not self._by_id:
+                            raise
+                        logger.warning("Failed to refresh model catalog: %s", e)
+
+        # No catalog yet and backing off: fail fast with the last fetch error
+        if not self._by_id and self._last_error is not None:
+            raise self._last_error.with_traceback(None)
+
+        return self.lookup(model_id)
+
+
+# Global catalog instance
+model_catalog = ModelCatalog()
+
+
+async def get_model(model_id: str, http_client: httpx.AsyncClient) -> Optional[Dict[str, Any]]:
+    """Return OpenRouter metadata for model_id, or None if the model does not exist"""
+    return await model_catalog.get(model_id, http_client)
@@ -0,0 +1,34 @@
+"""
+Coalescing of identical in-flight upstream requests
+"""
+
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+import orjson
+
+T = TypeVar("T")
+
+
+class RequestCoalescer:
+    """Share one upstream call between concurrent callers sending the same payload"""
+    
+    def __init__(self):
+        self._inflight: Dict[bytes, asyncio.Task] = {}
+    
+    @staticmethod
+    def key(payload: Dict[str, Any]) -> bytes:
+        """Stable digest of a request payload"""
+        return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).digest()
+    
+    async def run(self, key: bytes, call: Callable[[], Awaitable[T]]) -> T:
+        """Await the in-flight call for key, starting it if nobody else has"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shield so one caller disconnecting does not cancel the call for the others
+        return await asyncio.shield(task)
@@ -0,0 +1,59 @@
+"""
+In-memory cache of deterministic (temperature 0) model responses
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from services.request_coalescer import RequestCoalescer
+
+# How long a cached response is served, and how many responses are kept
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+
+
+class LLMCache:
+    """LRU cache with per-entry expiry, keyed by a digest of the request payload"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[float, Any]]" = OrderedDict()
+
+    # Same canonical payload digest the request coalescer uses
+    key = staticmethod(RequestCoalescer.key)
+
+    def get(self, key: bytes) -> Optional[Any]:
+        """Return the cached value for key, or None if missing or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if time.monotonic() > expires_at:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: bytes, value: Any):
+        """Store value under key, evicting the least recently used entry if full"""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Global cache of streamed responses: payload digest -> list of SSE data chunks
+response_cache: LLMCache = LLMCache()
+
+
+def is_cacheable(payload: Dict[str, Any]) -> bool:
+    """Only explicitly deterministic requests without tools are safe to replay"""
+    return payload.get('temperature') == 0 and 'tools' not in payload
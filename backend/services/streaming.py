@@ -0,0 +1,67 @@
+"""
+Helpers for reading OpenRouter server-sent event (SSE) streams
+"""
+
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Dict
+import httpx
+
+DATA_PREFIX = b"data: "
+SSE_DONE = b"[DONE]"
+
+# Response headers for streamed bodies: tell nginx-style proxies not to buffer
+STREAM_HEADERS = {"X-Accel-Buffering": "no"}
+
+# Admission control: streams beyond this many wait in-process for a free slot
+MAX_UPSTREAM_INFLIGHT = int(os.getenv("MAX_UPSTREAM_INFLIGHT", "32"))
+_upstream_slots = asyncio.Semaphore(MAX_UPSTREAM_INFLIGHT)
+_upstream_stats = {"inflight": 0, "waiting": 0}
+
+
+@asynccontextmanager
+async def upstream_slot():
+    """Hold one of the MAX_UPSTREAM_INFLIGHT upstream streaming slots"""
+    _upstream_stats["waiting"] += 1
+    try:
+        await _upstream_slots.acquire()
+    finally:
+        _upstream_stats["waiting"] -= 1
+    
+    _upstream_stats["inflight"] += 1
+    try:
+        yield
+    finally:
+        _upstream_stats["inflight"] -= 1
+        _upstream_slots.release()
+
+
+def upstream_stats() -> Dict[str, int]:
+    """Snapshot of the upstream admission-control counters"""
+    return {"limit": MAX_UPSTREAM_INFLIGHT, **_upstream_stats}
+
+
+async def aiter_sse_data(response: httpx.Response) -> AsyncGenerator[bytes, None]:
+    """
+    Yield the payload of every `data:` line in a streaming response
+
+    Lines are located with bytearray.find from a moving cursor, so each byte is
+    scanned once; consumed bytes are dropped once per network read rather than
+    per line. Stops after yielding SSE_DONE.
+    """
+    buffer = bytearray()
+    
+    async for chunk in response.aiter_bytes():
+        buffer.extend(chunk)
+        start = 0
+        
+        while (line_end := buffer.find(b"\n", start)) != -1:
+            if buffer.startswith(DATA_PREFIX, start, line_end):
+                data = bytes(buffer[start + 6:line_end]).strip()
+                yield data
+                if data == SSE_DONE:
+                    return
+            start = line_end + 1
+        
+        del buffer[:start]
@@ -0,0 +1,90 @@
+"""
+Tests for trim_history: which attachments are kept and which are elided
+Run from backend/: python -m unittest discover tests
+"""
+
+import unittest
+
+from services.chat_service import trim_history
+
+
+def user(*blocks):
+    return {'role': 'user', 'content': [{'type': 'text', 'text': 'question'}, *blocks]}
+
+
+def assistant():
+    return {'role': 'assistant', 'content': 'answer'}
+
+
+def image(url):
+    return {'type': 'image_url', 'image_url': {'url': url}}
+
+
+def pdf(filename, data):
+    return {'type': 'file', 'file': {'filename': filename, 'file_data': data}}
+
+
+def audio(data):
+    return {'type': 'input_audio', 'input_audio': {'data': data, 'format': 'wav'}}
+
+
+def conversation(first, turns):
+    """first is attached to the opening user turn, followed by turns text-only exchanges"""
+    messages = [user(first), assistant()]
+    for _ in range(turns):
+        messages += [user(), assistant()]
+    return messages
+
+
+class TrimHistoryTests(unittest.TestCase):
+
+    def test_only_copy_is_kept_however_old(self):
+        for block in (image("data:image/png;base64,AAA"), pdf("doc.pdf", "PPP"), audio("WWW")):
+            messages = conversation(block, turns=20)
+            trim_history(messages)
+            self.assertEqual(messages[0]['content'][1], block)
+
+    def test_older_duplicate_is_elided(self):
+        messages = [
+            user(image("data:image/png;base64,AAA")), assistant(),
+            user(image("data:image/png;base64,AAA")), assistant(),
+        ]
+        trim_history(messages)
+        self.assertEqual(messages[0]['content'][1], {'type': 'text', 'text': '[image omitted]'})
+        self.assertEqual(messages[2]['content'][1], image("data:image/png;base64,AAA"))
+
+    def test_distinct_attachments_are_kept(self):
+        messages = [
+            user(image("data:image/png;base64,AAA")), assistant(),
+            user(image("data:image/png;base64,BBB")), assistant(),
+        ]
+        trim_history(messages)
+        self.assertEqual(messages[0]['content'][1], image("data:image/png;base64,AAA"))
+        self.assertEqual(messages[2]['content'][1], image("data:image/png;base64,BBB"))
+
+    def test_duplicate_pdf_placeholder_names_the_file(self):
+        messages = [user(pdf("a.pdf", "PPP")), assistant(), user(pdf("b.pdf", "PPP"))]
+        trim_history(messages)
+        self.assertEqual(messages[0]['content'][1], {'type': 'text', 'text': '[PDF omitted: a.pdf]'})
+        self.assertEqual(messages[2]['content'][1], pdf("b.pdf", "PPP"))
+
+    def test_max_media_age_elides_old_attachments_when_set(self):
+        messages = conversation(audio("WWW"), turns=2)
+        trim_history(messages, max_media_age=2)
+        self.assertEqual(messages[0]['content'][1], audio("WWW"))
+
+        messages = conversation(audio("WWW"), turns=3)
+        trim_history(messages, max_media_age=2)
+        self.assertEqual(messages[0]['content'][1], {'type': 'text', 'text': '[audio omitted]'})
+
+    def test_text_is_never_dropped(self):
+        messages = conversation(image("data:image/png;base64,AAA"), turns=3)
+        messages.append(user(image("data:image/png;base64,AAA")))
+        trim_history(messages, max_media_age=1)
+        for msg in messages:
+            if msg['role'] == 'user':
+                self.assertEqual(msg['content'][0], {'type': 'text', 'text': 'question'})
+
+
+if __name__ == '__main__':
+    unittest.main()